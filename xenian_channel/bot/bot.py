@@ -59,11 +59,14 @@ def error(bot: Bot, update: Update, error: TelegramError):
 
 def main():
     global job_queue
+    # run_async handlers share this fixed number of worker threads. python-telegram-bot recommends a connection pool of
+    # workers + 4 and the message queues sender thread needs one more, so no thread has to wait for a free connection.
+    workers = 8
     queue = messagequeue.MessageQueue(all_burst_limit=20, all_time_limit_ms=2000)
-    request = Request(con_pool_size=8)
+    request = Request(con_pool_size=workers + 5)
     bot = MQBot(TELEGRAM_API_TOKEN, request=request, mqueue=queue)
 
-    updater = Updater(bot=bot)
+    updater = Updater(bot=bot, workers=workers)
     dispatcher = updater.dispatcher
 
     xenian_channel.bot.job_queue = updater.job_queue
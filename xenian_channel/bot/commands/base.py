@@ -1,16 +1,32 @@
 import logging
-from typing import Callable, Dict, List
+from functools import partial
+from typing import Callable, Dict, List, Type
 
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, TelegramObject, Update
 from telegram.ext import CommandHandler, Filters, MessageHandler
 
 from xenian_channel.bot.models import Button, TgChat, TgMessage, TgUser
-from xenian_channel.bot.settings import LOG_LEVEL
+from xenian_channel.bot.models.telegram import TelegramDocument
+from xenian_channel.bot.settings import DEBUG, LOG_LEVEL
+from xenian_channel.bot.utils.cache import LRUCache
 from xenian_channel.bot.utils.telegram import wants_update_bot
 
 __all__ = ['BaseCommand']
 
 
+def _dispatch(command_class: 'BaseCommand', method: callable, pass_update_bot: bool, bot: Bot, update: Update, *args,
+              **kwargs):
+    """Run :meth:`BaseCommand.on_call` and then the command itself
+
+    Used with :func:`functools.partial` in :meth:`BaseCommand.on_call_wrapper` so no closure is needed per command.
+    """
+    command_class.on_call(bot, update)
+    if pass_update_bot:
+        method(bot=bot, update=update, *args, **kwargs)
+    else:
+        method(*args, **kwargs)
+
+
 class BaseCommand:
     """Base of any command class
 
@@ -59,10 +75,22 @@ class BaseCommand:
             - hidden (:class:`bool`): If the command is shown in the overview of `/commands`
             - args (:class:`str`): If the command has arguments define them here as text like: "USERNAME PASSWORD"
             - group (:class:`int`): Which handler group the command should be in
+            - view (:class:`dict`): Set when normalizing, the values shown in /commands
         group (:class:`str`): The group name shown in the /commands message
+        commands_by_name (:obj:`dict`): The commands from :obj:`commands` by their command_name
+        shown_direct_commands (:obj:`list` of :obj:`dict`): Commands with a :class:`CommandHandler` shown in /commands
+        shown_indirect_commands (:obj:`list` of :obj:`dict`): Commands with a :class:`MessageHandler` shown in
+            /commands
+        user_cache (:obj:`LRUCache`): Last seen users with their saved :obj:`TgUser`
+        chat_cache (:obj:`LRUCache`): Last seen chats with their saved :obj:`TgChat`
+        rendered_commands (:obj:`dict`): Cache of the rendered /commands messages by mode, reset whenever a new command
+            class is initialized
     """
     all_commands = []
     commands = []
+    user_cache = LRUCache(maxsize=10000)
+    chat_cache = LRUCache(maxsize=10000)
+    rendered_commands = {}
     group = 'Base Group'
 
     def __init__(self):
@@ -81,19 +109,20 @@ class BaseCommand:
         self.tg_user = None
         self.tg_message = None
 
-        BaseCommand.all_commands.append(self)
+        # Do not register the same command class twice, otherwise all its handlers would run twice per update
+        if not any(type(command_class) is type(self) for command_class in BaseCommand.all_commands):
+            BaseCommand.all_commands.append(self)
 
         self.normalize_commands()
+        BaseCommand.rendered_commands.clear()
 
     def on_call_wrapper(self, method: callable):
-        def wrapper(bot: Bot, update: Update, *args, **kwargs):
-            self.on_call(bot, update)
-            if wants_update_bot(method):
-                method(bot=bot, update=update, *args, **kwargs)
-            else:
-                method(*args, **kwargs)
+        return partial(_dispatch, self, method, wants_update_bot(method))
 
-        return wrapper
+    @staticmethod
+    def is_wrapped(method: callable) -> bool:
+        """Check if the method was already wrapped with :meth:`on_call_wrapper`"""
+        return isinstance(method, partial) and method.func is _dispatch
 
     def on_call(self, bot: Bot, update: Update):
         self.bot = bot
@@ -104,15 +133,36 @@ class BaseCommand:
         self.chat = update.effective_chat
 
         if self.user:
-            self.tg_user = TgUser(self.user)
-            self.tg_user.save()
+            self.tg_user = self.get_cached_document(TgUser, self.user, BaseCommand.user_cache)
         if self.chat:
-            self.tg_chat = TgChat(self.chat)
-            self.tg_chat.save()
+            self.tg_chat = self.get_cached_document(TgChat, self.chat, BaseCommand.chat_cache)
         if self.message:
             self.tg_message = TgMessage.from_object(self.message)
             self.tg_message.save()
 
+    @staticmethod
+    def get_cached_document(document: Type[TelegramDocument], tg_object: TelegramObject,
+                            cache: LRUCache) -> TelegramDocument:
+        """Get the document for a telegram object and only save it if it changed since it was seen last
+
+        Args:
+            document (:obj:`Type[TelegramDocument]`): Document class of the telegram object
+            tg_object (:obj:`TelegramObject`): The telegram object like a user or chat
+            cache (:obj:`LRUCache`): Cache of the last seen documents by id
+
+        Returns:
+            :obj:`TelegramDocument`: The saved document
+        """
+        data = tg_object.to_dict()
+        cached = cache.get(tg_object.id)
+        if cached is not None and cached[0] == data:
+            return cached[1]
+
+        tg_document = document(tg_object)
+        tg_document.save()
+        cache[tg_object.id] = data, tg_document
+        return tg_document
+
     @classmethod
     def bot_started(cls, bot: Bot):
         for command_class in BaseCommand.all_commands:
@@ -124,34 +174,46 @@ class BaseCommand:
         """
         updated_commands = []
         alias_commands = []
+        self.commands_by_name = {}
         for command in self.commands:
             if isinstance(command.get('alias', None), str):
                 alias_commands.append(command)
                 continue
 
+            # Already normalized, wrapping it again would run on_call twice per update
+            if self.is_wrapped(command['command']):
+                updated_commands.append(command)
+                self.commands_by_name.setdefault(command['command_name'], command)
+                continue
+
+            method = command['command']
+            handler = command.get('handler', CommandHandler)
+            options = command.get('options', {})
             command = {
-                'title': command.get('title', None) or command['command'].__name__.capitalize().replace('_', ' '),
+                'title': command.get('title', None) or method.__name__.capitalize().replace('_', ' '),
                 'description': command.get('description', ''),
-                'command_name': command.get('command_name', command['command'].__name__),
-                'command': self.on_call_wrapper(command['command']),
-                'handler': command.get('handler', CommandHandler),
-                'options': command.get('options', {}),
+                'command_name': command.get('command_name', method.__name__),
+                'command': self.on_call_wrapper(method),
+                'handler': handler,
+                'options': options,
                 'hidden': command.get('hidden', False),
                 'args': command.get('args', []),
                 'group': command.get('group', 0)
             }
+            command['group'] = self._validate_group(command)
 
-            if command['handler'] == CommandHandler and command['options'].get('command', None) is None:
-                command['options']['command'] = command['command_name']
+            if handler is CommandHandler and options.get('command', None) is None:
+                options['command'] = command['command_name']
 
-            if command['handler'] == MessageHandler and command['options'].get('filters', None) is None:
-                command['options']['filters'] = Filters.all
+            if handler is MessageHandler and options.get('filters', None) is None:
+                options['filters'] = Filters.all
 
             # Set CallbackQueryHandler options if not yet set
-            if command['options'].get('callback', None) is None:
-                command['options']['callback'] = command['command']
+            if options.get('callback', None) is None:
+                options['callback'] = command['command']
 
             updated_commands.append(command)
+            self.commands_by_name.setdefault(command['command_name'], command)
 
         self.commands = updated_commands
 
@@ -167,27 +229,54 @@ class BaseCommand:
             for key, value in alias_command.items():
                 if key in ['title', 'description', 'hidden', 'group', 'command_name']:
                     new_command[key] = value
+            new_command['group'] = self._validate_group(new_command)
 
             updated_commands.append(new_command)
+            self.commands_by_name.setdefault(new_command['command_name'], new_command)
+
+        self.shown_direct_commands = [cmd for cmd in updated_commands
+                                      if cmd['handler'] is CommandHandler and (DEBUG or not cmd['hidden'])]
+        self.shown_indirect_commands = [cmd for cmd in updated_commands
+                                        if cmd['handler'] is MessageHandler and not cmd['hidden']]
 
+        # What the /commands templates need, so these dicts do not have to be built on each render
         for command in updated_commands:
-            try:
-                int(command['group'])
-            except ValueError:
-                raise ValueError('Command group has to be an integer: command {}, given group {}'.format(
-                    command['command_name'], command['group']
-                ))
+            command['view'] = {
+                'command': command['command_name'],
+                'args': command['args'],
+                'title': command['title'],
+                'description': command['description'],
+            }
 
-        self.commands = updated_commands
+    @staticmethod
+    def _validate_group(command: Dict) -> int:
+        """Make sure the group of the command is an integer
+
+        Args:
+            command (:obj:`Dict`): A command dict
+
+        Returns:
+            :obj:`int`: The group of the command as integer
+
+        Raises:
+            ValueError: If the group cannot be converted to an integer
+        """
+        group = command['group']
+        if isinstance(group, int):
+            return group
+
+        try:
+            return int(group)
+        except ValueError:
+            raise ValueError('Command group has to be an integer: command {}, given group {}'.format(
+                command['command_name'], group
+            ))
 
     def copy_command(self, command: Dict) -> Dict:
         """Copy command to a new dict
 
-        Do not use a single Dict.copy because the dicts are multidimensional and .copy i only onedimensional.
-        Do not use deepcopy because it copies functions to a new object which leads to errors
-
-        Instead we use copy the dict with its normal copy function and then iterate over the dict and repeat this for
-        every sub dict.
+        Do not use deepcopy because it copies functions to a new object which leads to errors. The only nested dict
+        which is changed on a copy are the options, so copying the command and its options is sufficient.
 
         Args:
             command (:obj:`Dict`): A command dict to copy
@@ -197,9 +286,7 @@ class BaseCommand:
 
         """
         new_command = command.copy()
-        for key, value in command.items():
-            if isinstance(value, Dict):
-                new_command[key] = self.copy_command(value)
+        new_command['options'] = command['options'].copy()
         return new_command
 
     def get_command_by_name(self, name: str) -> dict:
@@ -211,8 +298,7 @@ class BaseCommand:
         Returns:
             (:obj:`dict` | :obj:`None`): The found command or :obj:`None` if no command was found
         """
-        commands_found = list(filter(lambda command: command['command_name'] == name, self.commands))
-        return commands_found[0] if commands_found else None
+        return self.commands_by_name.get(name)
 
     def not_implemented(self, *args, **kwargs):
         if LOG_LEVEL <= logging.DEBUG:
@@ -229,32 +315,42 @@ class BaseCommand:
         if isinstance(abort_callback, Callable):
             abort_callback = abort_callback.__name__
 
-        button = Button(text=text, callback=callback, data=data or {}, url=url or '', prefix=prefix,
-                        confirmation_requred=confirmation_requred, abort_callback=abort_callback)
-        button.save()
-        return button
+        # The button is saved when it is converted, see :meth:`convert_buttons`
+        return Button(text=text, callback=callback, data=data or {}, url=url or '', prefix=prefix,
+                      confirmation_requred=confirmation_requred, abort_callback=abort_callback)
 
     def convert_button(self, button: Button) -> InlineKeyboardButton:
         if button.url:
             return InlineKeyboardButton(text=button.text, url=button.url)
 
+        if button.id is None:
+            button.save()
         return InlineKeyboardButton(text=button.text, callback_data=button.callback_data())
 
     def answer_convert_button(self, button: Button, answer_text: str, answer: bool) -> InlineKeyboardButton:
         return InlineKeyboardButton(text=answer_text, callback_data=button.callback_data(answer))
 
     def convert_buttons(self, buttons: List[List[Button or InlineKeyboardButton]]) -> InlineKeyboardMarkup:
-        real_buttons = []
-        for row in buttons:
-            new_row = []
-            for button in row:
-                if isinstance(button, InlineKeyboardButton):
-                    new_row.append(button)
-                    continue
-
-                new_row.append(self.convert_button(button))
-            real_buttons.append(new_row)
-        return InlineKeyboardMarkup(real_buttons)
+        """Convert the buttons to an inline keyboard
+
+        All buttons which are not yet saved are inserted with a single query instead of one per button.
+
+        Args:
+            buttons (:obj:`List[List[Button | InlineKeyboardButton]]`): Rows of buttons
+
+        Returns:
+            :obj:`InlineKeyboardMarkup`: The keyboard markup
+        """
+        unsaved = [button for row in buttons for button in row
+                   if isinstance(button, Button) and not button.url and button.id is None]
+        if unsaved:
+            for button, button_id in zip(unsaved, Button.objects.insert(unsaved, load_bulk=False)):
+                button.id = button_id
+
+        return InlineKeyboardMarkup([
+            [button if isinstance(button, InlineKeyboardButton) else self.convert_button(button) for button in row]
+            for row in buttons
+        ])
 
     def get_button(self, button_id: str) -> Button:
         prefix, button_id = button_id.split(':', 1)
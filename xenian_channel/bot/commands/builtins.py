@@ -1,16 +1,23 @@
-from typing import Dict, Iterable
+import logging
+from collections import defaultdict
+from typing import Iterable, List, Tuple
 
-from telegram import Bot, Chat
-from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler
+from telegram import Bot
+from telegram.ext import CallbackQueryHandler
 from telegram.parsemode import ParseMode
 
-# from xenian_channel.bot import mongodb_database
+from xenian_channel.bot.models import TgUser
 from xenian_channel.bot.settings import ADMINS, DEBUG, SUPPORTER
 from xenian_channel.bot.utils import get_user_chat_link, render_template
 from .base import BaseCommand
 
 __all__ = ['builtins']
 
+logger = logging.getLogger(__name__)
+
+ADMIN_USERNAMES = frozenset(ADMINS)
+SUPPORTER_USERNAMES = frozenset(SUPPORTER)
+
 
 class Builtins(BaseCommand):
     """A set of base commands which every bot should have
@@ -44,9 +51,6 @@ class Builtins(BaseCommand):
             },
         ]
 
-        # self.admin_db = mongodb_database.admins
-        # self.supporter_db = mongodb_database.supporter
-
         super(Builtins, self).__init__()
 
     def callback_nothing(self):
@@ -60,42 +64,47 @@ class Builtins(BaseCommand):
     def commands(self, args):
         """Generate and show list of available commands
 
+        The rendered lists are cached per mode in :obj:`BaseCommand.rendered_commands` as the commands do not change
+        after startup.
+
         Args:
             args (:obj:`list`, optional): List of sent arguments
         """
-        direct_commands = {}
-        indirect_commands = {}
-        for command_class in BaseCommand.all_commands:
-            group_name = command_class.group
+        if 'raw' in args:
+            mode = 'raw'
+        elif 'rst' in args:
+            mode = 'rst'
+        else:
+            mode = 'html'
 
-            direct_commands.setdefault(group_name, [])
-            indirect_commands.setdefault(group_name, [])
+        replies = BaseCommand.rendered_commands.get(mode)
+        if replies is None:
+            replies = BaseCommand.rendered_commands[mode] = self.render_commands(mode)
 
-            all_commands = command_class.commands
-            shown_commands = filter(lambda cmd: cmd['handler'] == CommandHandler and (DEBUG or not cmd['hidden']),
-                                    all_commands)
+        for text, parse_mode in replies:
+            self.message.reply_text(text, parse_mode=parse_mode)
+
+    def render_commands(self, mode: str) -> List[Tuple[str, str or None]]:
+        """Render the list of available commands
+
+        Args:
+            mode (:obj:`str`): Either "raw", "rst" or "html"
+
+        Returns:
+            :obj:`List[Tuple[str, str or None]]`: The messages to send as tuples of text and parse mode
+        """
+        direct_commands = defaultdict(list)
+        indirect_commands = defaultdict(list)
+        for command_class in BaseCommand.all_commands:
+            group_name = command_class.group
 
             # Direct commands (CommandHandler)
-            for command in shown_commands:
-                direct_commands[group_name].append({
-                    'command': command['command_name'],
-                    'args': command['args'],
-                    'title': command['title'],
-                    'description': command['description'],
-                })
-            if not direct_commands[group_name]:
-                del direct_commands[group_name]
+            for command in command_class.shown_direct_commands:
+                direct_commands[group_name].append(command['view'])
 
             # Indirect commands (MessageHandler)
-            for command in [cmd for cmd in command_class.commands
-                            if cmd['handler'] == MessageHandler and not cmd['hidden']]:
-                indirect_commands[group_name].append({
-                    'title': command['title'],
-                    'description': command['description'],
-                })
-
-            if not indirect_commands[group_name]:
-                del indirect_commands[group_name]
+            for command in command_class.shown_indirect_commands:
+                indirect_commands[group_name].append(command['view'])
 
         if DEBUG:
             direct_commands['Bot Helpers'].append({
@@ -105,23 +114,26 @@ class Builtins(BaseCommand):
                 'description': 'Restart the bot',
             })
 
-        if 'raw' in args:
-            reply = render_template('commands_raw.html.mako', direct_commands=direct_commands)
-        elif 'rst' in args:
+        direct_commands = dict(direct_commands)
+        indirect_commands = dict(indirect_commands)
+
+        if mode == 'raw':
+            return [(render_template('commands_raw.html.mako', direct_commands=direct_commands), ParseMode.HTML)]
+        elif mode == 'rst':
             reply_direct = render_template('commands_rst_direct.mako', direct_commands=direct_commands)
-            print(reply_direct)
-            self.message.reply_text(reply_direct)
+            logger.debug(reply_direct)
+            replies = [(reply_direct, None)]
 
             if indirect_commands:
                 reply_indirect = render_template('commands_rst_indirect.mako', indirect_commands=indirect_commands)
-                print(reply_indirect)
-                self.message.reply_text(reply_indirect)
-            return
-        else:
-            reply = render_template('commands.html.mako',
-                                    direct_commands=direct_commands,
-                                    indirect_commands=indirect_commands)
-        self.message.reply_text(reply, parse_mode=ParseMode.HTML)
+                logger.debug(reply_indirect)
+                replies.append((reply_indirect, None))
+            return replies
+
+        reply = render_template('commands.html.mako',
+                                direct_commands=direct_commands,
+                                indirect_commands=indirect_commands)
+        return [(reply, ParseMode.HTML)]
 
     def support(self):
         """Contact bot maintainer for support of any kind
@@ -129,13 +141,15 @@ class Builtins(BaseCommand):
         self.message.reply_text(
             'If you need any help do not hesitate to contact me via "/contribute YOUR_MESSAGE", if you have found an '
             'error please use "/error ERROR_DESCRIPTION".\n\nIf you like this bot you can give me rating here: '
-            'https://telegram.me/storebot?start=xenianchannelbot'.format(SUPPORTER[0]))
+            'https://telegram.me/storebot?start=xenianchannelbot')
 
     def contribute_error(self):
         """User can use /contribute or /error to let all supporters / admins know of something
         """
         split_text = self.message.text.split(' ', 1)
-        command = split_text[0].lstrip('/')
+        command = split_text[0]
+        if command.startswith('/'):
+            command = command[1:]
 
         if len(split_text) < 2:
             self.message.reply_text(f'Please describe your request with "/{command} YOUR_DESCRIPTION"')
@@ -145,45 +159,38 @@ class Builtins(BaseCommand):
         user = get_user_chat_link(self.message.from_user)
         message_text = f'{command.capitalize()} form {user}: {text}'
 
-        self.write_to_chats(self.bot, self.admin_db.find(), message_text)
-        self.write_to_chats(self.bot, self.supporter_db.find(), message_text)
+        # Private chats have the same id as the user, so the ids of the known admins and supporters are enough
+        usernames = {name.lstrip('@') for name in ADMIN_USERNAMES | SUPPORTER_USERNAMES}
+        chat_ids = set(TgUser.objects(username__in=list(usernames)).scalar('id'))
+        self.write_to_chats(self.bot, chat_ids, message_text)
 
         self.message.reply_text('I forwarded your request to the admins and supporters.')
 
     @staticmethod
-    def write_to_chats(bot: Bot, chats: Iterable[Chat] or Iterable[Dict[str]], message: str):
+    def write_to_chats(bot: Bot, chat_ids: Iterable[int], message: str):
         """Send a message to all given chats
 
+        The bot delegates its send methods to the message queue, so the messages are only queued here and sent in the
+        background without waiting for each request to finish.
+
         Args:
             bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
-            chats (:obj:`Iterable[Chat]` | :obj:`Iterable[Dict[str]]`): A list of chats to write to
+            chat_ids (:obj:`Iterable[int]`): The ids of the chats to write to
             message (:obj:`str`): The text to send
         """
-        for chat in chats:
-            id = None
-            if isinstance(chat, Chat):
-                id = chat.id
-            elif isinstance(chat, dict):
-                id = chat.get('id') or chat.get('chat_id')
-
-            if not id:
-                continue
-
-            bot.send_message(chat_id=id, text=message)
+        for chat_id in chat_ids:
+            bot.send_message(chat_id=chat_id, text=message)
 
     def register(self):
         """Register the chat_id for admins and supporters
         """
-        data = {'chat_id': self.chat.id}
-
         reply = 'You were registered as an'
+        username = f'@{self.user.username}'
 
-        if '@{}'.format(self.user.username) in ADMINS:
-            self.admin_db.update(data, data, upsert=True)
+        if username in ADMIN_USERNAMES:
             reply += '\n - Admin'
 
-        if '@{}'.format(self.user.username) in SUPPORTER:
-            self.supporter_db.update(data, data, upsert=True)
+        if username in SUPPORTER_USERNAMES:
             reply += '\n - Supporter'
 
         if not '\n' in reply:
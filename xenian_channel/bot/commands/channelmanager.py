@@ -1,37 +1,118 @@
 import logging
 import random
 import re
+import time
 from collections import namedtuple
 from datetime import datetime, timedelta
-from itertools import chain
+from itertools import chain, islice
 from typing import Callable, Dict, Iterable, List, Tuple
 from uuid import uuid4
 
 import emoji
+from mongoengine import GenericReferenceField, NotUniqueError
 import parsedatetime
+from pymongo import ReturnDocument
 import pytimeparse
 from pytz import timezone
-from telegram import Bot, Chat, InlineKeyboardButton, InlineKeyboardMarkup, Message, Update, User
-from telegram.error import BadRequest, TimedOut
+from telegram import (Animation, Audio, Bot, Chat, ChatMember, Document, InlineKeyboardButton, InlineKeyboardMarkup,
+                      Message, Update, User, Video, VideoNote)
+from telegram.error import BadRequest, RetryAfter, TimedOut
 from telegram.ext import CallbackQueryHandler, Job, MessageHandler, run_async
 from telegram.parsemode import ParseMode
-from telegram.utils.promise import Promise
 
 from xenian_channel.bot import job_queue
 from xenian_channel.bot.models import (Button, ChannelSettings, TgChat, TgMessage, TgUser, UserState,
                                        APPEND_SCHEDULE, EXTEND_SCHEDULE)
 from xenian_channel.bot.settings import ADMINS, LOG_LEVEL
-from xenian_channel.bot.utils import TelegramProgressBar, get_self
-from xenian_channel.bot.utils.models import resolve_dbref
+from xenian_channel.bot.utils import LRUCache, TelegramProgressBar, send_and_wait
+from xenian_channel.bot.utils.models import resolve_dbrefs
 from .base import BaseCommand
 
 __all__ = ['channel']
 
 Permission = namedtuple('Permission', ['is_admin', 'post', 'delete', 'edit'])
 
+MARKDOWN_ESCAPE_TABLE = str.maketrans({
+    **{char: f'\\{char}' for char in '\\`*_{}[]()#+,-.!"\''},
+    '<': '&lt;',
+    '>': '&gt;',
+    '$': '&amp;',
+})
+NON_DIGIT_RE = re.compile(r'\D')
+ADMIN_USERNAMES = frozenset(ADMINS)
+STATE_CACHE_TIMEOUT = 30
+CHAT_TITLE_CACHE_TIMEOUT = 60
+PERMISSION_CACHE_TIMEOUT = 60
+SEND_ATTEMPTS = 3  # How many times the messages of a post are queued at most when Telegram answers with RetryAfter
+
+ADD_CHANNEL_INSTRUCTIONS = (
+    "*Adding a channel*"
+    "\n"
+    "\nTo add a channel follow these instructions"
+    "\n"
+    "\n1. Make sure @XenianChannelBot is and admin of your channel"
+    "\n2. Forward me any message from that channel"
+)
+
+
+def thumb_id(file: Animation or Audio or Document or Video or VideoNote) -> str or None:
+    """Get the file id of the thumbnail of a file if it has one
+    """
+    return file.thumb.file_id if file.thumb else None
+
+
+# Send method and its keyword arguments by the attribute of the message holding the file. The first match is used,
+# animations for example are documents too.
+SEND_METHODS = (
+    ('photo', 'send_photo', lambda message, photo: {'photo': photo[-1], 'caption': message.caption}),
+    ('animation', 'send_animation', lambda message, animation: {
+        'animation': animation,
+        'caption': message.caption,
+        'duration': animation.duration,
+        'width': animation.width,
+        'height': animation.height,
+        'thumb': thumb_id(animation),
+    }),
+    ('sticker', 'send_sticker', lambda message, sticker: {'sticker': sticker}),
+    ('audio', 'send_audio', lambda message, audio: {
+        'audio': audio,
+        'caption': message.caption,
+        'duration': audio.duration,
+        'performer': audio.performer,
+        'title': audio.title,
+        'thumb': thumb_id(audio),
+    }),
+    ('document', 'send_document', lambda message, document: {
+        'document': document,
+        'caption': message.caption,
+        'filename': document.file_name,
+        'thumb': thumb_id(document),
+    }),
+    ('video', 'send_video', lambda message, video: {
+        'video': video,
+        'caption': message.caption,
+        'duration': video.duration,
+        'width': video.width,
+        'height': video.height,
+        'supports_streaming': True,
+        'thumb': thumb_id(video),
+    }),
+    ('video_note', 'send_video_note', lambda message, video_note: {
+        'video_note': video_note,
+        'duration': video_note.duration,
+        'length': video_note.length,
+        'thumb': thumb_id(video_note),
+    }),
+    ('voice', 'send_voice', lambda message, voice: {
+        'voice': voice,
+        'duration': voice.duration,
+        'caption': message.caption,
+    }),
+)
+
 
 class JobsQueue:
-    all_jobs = []
+    all_jobs = {}  # {(user_id, type): JobsQueue}, only replaceable jobs are kept
 
     class types:
         SEND_BUTTON_MESSAGE = 'send_button_message'
@@ -41,7 +122,6 @@ class JobsQueue:
         self.job = job
         self.type = type
         self.replaceable = replaceable
-        JobsQueue.all_jobs.append(self)
 
         self.replace()
 
@@ -49,14 +129,11 @@ class JobsQueue:
         if not self.replaceable:
             return
 
-        jobs = [job for job in JobsQueue.all_jobs if
-                job.user_id == self.user_id and job.type == self.type and job != self]
-        if not jobs:
-            return
-
-        for job in jobs:
-            JobsQueue.all_jobs.remove(job)
-            job.job.schedule_removal()
+        key = (self.user_id, self.type)
+        previous = JobsQueue.all_jobs.get(key)
+        JobsQueue.all_jobs[key] = self
+        if previous is not None and previous is not self:
+            previous.job.schedule_removal()
 
 
 class ChannelManager(BaseCommand):
@@ -66,7 +143,11 @@ class ChannelManager(BaseCommand):
     name = 'Channel Manager'
     group = 'Channel Manager'
 
-    sent_file_id_cache = {}  # {ChannelSettings obj: [file_id, ...]]}}
+    sent_file_id_cache = LRUCache(maxsize=100)  # {ChannelSettings id: [file_id, ...]]}}
+    state_cache = LRUCache(maxsize=10000)  # {user id: (timestamp, UserState obj)}
+    permission_cache = LRUCache(maxsize=1000)  # {chat id: (timestamp, Permission)}
+    chat_title_cache = LRUCache(maxsize=1000)  # {(chat id, is markdown): (timestamp, title)}
+    reaction_buttons_cache = LRUCache(maxsize=100)  # {(reactions, with_callback): [[InlineKeyboardButton, ...]]}
 
     def __init__(self):
         self.commands = [
@@ -106,6 +187,21 @@ class ChannelManager(BaseCommand):
             },
         ]
 
+        # Handlers for messages by the users state, most messages are sent while idle and are not handled at all
+        self.message_handlers = {
+            UserState.ADDING_CHANNEL: self.register_channel_message_handler,
+            UserState.CHANGE_DEFAULT_CAPTION: self.change_caption_message_handler,
+            UserState.CHANGE_DEFAULT_REACTION: self.change_reactions_message_handler,
+            UserState.CREATE_SINGLE_POST: self.queue_message_message_handler,
+            UserState.IMPORT_MESSAGES: self.add_message_to_import_queue_message_handler,
+        }
+        # Handlers which get the text of the message as the given keyword argument
+        self.text_message_handlers = {
+            UserState.SCHEDULE_ADDED_MESSAGES_WHEN: (self.schedule_delay_menu, 'time_str'),
+            UserState.SCHEDULE_ADDED_MESSAGES_DELAY: (self.schedule_batch_size_menu, 'delay_str'),
+            UserState.SCHEDULE_ADDED_MESSAGES_BATCH: (self.schedule_confirmation_menu, 'amount'),
+        }
+
         self.tg_user = None
         self.tg_chat = None
         self.tg_message = None
@@ -118,11 +214,38 @@ class ChannelManager(BaseCommand):
         super(ChannelManager, self).on_call(bot, update)
 
         if self.user:
-            data = dict(user=self.tg_user)
-            self.tg_state = next(iter(UserState.objects(**data)), UserState(**data))
+            self.tg_state = self.get_user_state()
             if self.tg_state.current_channel:
                 self.tg_state.current_channel._bot = self.bot
 
+    def get_user_state(self) -> UserState:
+        """Get the state of the current user
+
+        The states are only changed through here, so they are cached by user id. The current channel is changed from
+        scheduled jobs and channel posts as well, so on a cached state only the channel document itself is fetched again
+        by its id. The messages it references are loaded when they are accessed, like on a freshly loaded state. Cached
+        states are loaded again after :obj:`STATE_CACHE_TIMEOUT` seconds, so changes from other processes are picked up
+        eventually.
+
+        Returns:
+            :obj:`UserState`: The users state
+        """
+        cached = ChannelManager.state_cache.get(self.user.id)
+        if cached is None or time.time() - cached[0] > STATE_CACHE_TIMEOUT:
+            state = UserState.objects(user=self.tg_user).first() or UserState(user=self.tg_user)
+            ChannelManager.state_cache[self.user.id] = time.time(), state
+            return state
+
+        state = cached[1]
+
+        channel = state._data.get('current_channel')
+        if channel is not None:
+            channel_id = channel.pk if isinstance(channel, ChannelSettings) else getattr(channel, 'id', channel)
+            # reload() would load every message the channel references, so only fetch the channel by its id. If it
+            # was removed in the meantime the reference was already nullified in the database.
+            state.current_channel = ChannelSettings.objects(pk=channel_id).first()
+        return state
+
     def start_hook(self, bot: Bot):
         self.load_scheduled()
 
@@ -172,11 +295,17 @@ class ChannelManager(BaseCommand):
 
     def get_username_or_link(self, chat: User or Chat or TgChat or TgUser or ChannelSettings,
                              is_markdown: bool = False):
-        real_chat = chat
+        """Get the name of a chat, stored chats and users are loaded from telegram so it is cached for a minute
+        """
         if isinstance(chat, ChannelSettings):
-            real_chat = chat.chat.to_object(self.bot)
-        elif isinstance(chat, TgChat) or isinstance(chat, TgUser):
-            real_chat = chat.to_object(self.bot)
+            chat = chat.chat
+
+        cache_key = chat.id, is_markdown
+        cached = ChannelManager.chat_title_cache.get(cache_key)
+        if cached is not None and time.time() - cached[0] < CHAT_TITLE_CACHE_TIMEOUT:
+            return cached[1]
+
+        real_chat = chat.to_object(self.bot) if isinstance(chat, (TgChat, TgUser)) else chat
 
         if hasattr(real_chat, 'name'):
             chat_title = real_chat.name
@@ -188,11 +317,10 @@ class ChannelManager(BaseCommand):
             chat_title = real_chat.link
 
         if is_markdown:
-            chat_title = re.sub(r'([\\`*_{}\[\]()#+-.!"\'])', r'\\\1', chat_title)
-            chat_title = chat_title.replace('<', '&lt;').replace('>', '&gt;').replace('$', '&amp;')
-            return chat_title
-        else:
-            return chat_title
+            chat_title = chat_title.translate(MARKDOWN_ESCAPE_TABLE)
+
+        ChannelManager.chat_title_cache[cache_key] = time.time(), chat_title
+        return chat_title
 
     def get_channel_permissions_for_bot(self, chat: Chat):
         """Get usual permissions of bot from chat
@@ -200,125 +328,73 @@ class ChannelManager(BaseCommand):
         Args:
             chat (:obj:`telegram.chat.Chat`): Telegram Api Chat Object
 
+        Permissions where the bot is an admin are cached for a minute. Others are not cached, so the user can make the
+        bot an admin and try again right away.
+
         Returns:
             :obj:`Permission`: The channels Permission object
         """
-        myself = get_self(self.bot)
-        chat_member = self.bot.get_chat_member(chat.id, myself.id)
+        cached = ChannelManager.permission_cache.get(chat.id)
+        if cached is not None and time.time() - cached[0] < PERMISSION_CACHE_TIMEOUT:
+            return cached[1]
 
-        return Permission(
-            is_admin=chat_member.status == chat_member.ADMINISTRATOR,
+        chat_member = self.bot.get_chat_member(chat.id, self.bot.id)
+
+        permission = Permission(
+            is_admin=chat_member.status == ChatMember.ADMINISTRATOR,
             post=chat_member.can_post_messages,
             delete=chat_member.can_delete_messages,
             edit=chat_member.can_edit_messages,
         )
+        if permission.is_admin:
+            ChannelManager.permission_cache[chat.id] = time.time(), permission
+        return permission
 
-    def get_correct_send_message(self, message: Message, bot: Bot = None):
+    def get_correct_send_message(self, message: Message, bot: Bot = None) -> Tuple[Callable, Dict]:
         bot = bot or self.bot
-        method = bot.send_message
-        include_kwargs = {'text': message.text}
-
-        if message.photo:
-            method = bot.send_photo
-            include_kwargs = {'photo': message.photo[-1], 'caption': message.caption}
-        elif message.animation:
-            method = bot.send_animation
-            include_kwargs = {
-                'animation': message.animation,
-                'caption': message.caption,
-                'duration': message.animation.duration,
-                'width': message.animation.width,
-                'height': message.animation.height,
-                'thumb': message.animation.thumb.file_id if message.animation.thumb else None,
-            }
-        elif message.sticker:
-            method = bot.send_sticker
-            include_kwargs = {
-                'sticker': message.sticker,
-            }
-        elif message.audio:
-            method = bot.send_audio
-            include_kwargs = {
-                'audio': message.audio,
-                'caption': message.caption,
-                'duration': message.audio.duration,
-                'performer': message.audio.performer,
-                'title': message.audio.title,
-                'thumb': message.audio.thumb.file_id if message.audio.thumb else None,
-            }
-        elif message.document:
-            method = bot.send_document
-            include_kwargs = {
-                'document': message.document,
-                'caption': message.caption,
-                'filename': message.document.file_name,
-                'thumb': message.document.thumb.file_id if message.document.thumb else None,
-            }
-        elif message.video:
-            method = bot.send_video
-            include_kwargs = {
-                'video': message.video,
-                'caption': message.caption,
-                'duration': message.video.duration,
-                'width': message.video.width,
-                'height': message.video.height,
-                'supports_streaming': True,
-                'thumb': message.video.thumb.file_id if message.video.thumb else None,
-            }
-        elif message.video_note:
-            method = bot.send_video_note
-            include_kwargs = {
-                'video_note': message.video_note,
-                'duration': message.video_note.duration,
-                'length': message.video_note.length,
-                'thumb': message.video_note.thumb.file_id if message.video_note.thumb else None,
-            }
-        elif message.voice:
-            method = bot.send_voice
-            include_kwargs = {
-                'voice': message.voice,
-                'duration': message.voice.duration,
-                'caption': message.caption,
-            }
+        for attribute, method_name, get_kwargs in SEND_METHODS:
+            file = getattr(message, attribute)
+            if file:
+                return getattr(bot, method_name), get_kwargs(message, file)
 
-        try:
-            return method, include_kwargs
-        except Exception as e:
-            print(e)
-            pass
+        return bot.send_message, {'text': message.text}
 
     def prepare_send_message(self, message: TgMessage, is_preview: bool = False, bot: Bot = None,
-                             channel_settings: ChannelSettings = None) -> Tuple[
+                             channel_settings: ChannelSettings = None, reload_settings: bool = True) -> Tuple[
         Callable, Dict, Dict]:
         bot = bot or self.bot
         real_message = message.to_object(bot)
         method, keywords = self.get_correct_send_message(real_message, bot=bot)
         channel_settings = channel_settings or self.tg_current_channel
-        if not is_preview:
+        # When sending multiple messages the caller reloads the settings once beforehand
+        if not is_preview and reload_settings:
             channel_settings.reload('caption', 'reactions')
 
-        buttons = []
-
         if method == bot.send_message:
             keywords['text'] += f'\n\n{channel_settings.caption}'
         else:
             keywords['caption'] = ((real_message.caption_markdown or '') + '\n\n' + (channel_settings.caption or '')).strip()
         keywords['parse_mode'] = ParseMode.MARKDOWN
 
+        reaction_dict = dict((reaction, []) for reaction in message.reactions or channel_settings.reactions)
+        # Nobody has reacted yet, so the buttons are the same for every message with the same reactions
+        cache_key = tuple(reaction_dict), not is_preview
+        reaction_buttons = ChannelManager.reaction_buttons_cache.get(cache_key)
+        if reaction_buttons is None:
+            reaction_buttons = self.get_reactions_tg_buttons(reactions=reaction_dict, with_callback=not is_preview)
+            ChannelManager.reaction_buttons_cache[cache_key] = reaction_buttons
+
         if is_preview:
-            buttons.extend([[
-                self.create_button('Delete', callback=self.remove_from_queue_callback_query,
-                                   data={'message_id': message.message_id})
-            ]])
+            # Only the delete button differs per message, the reaction rows are shared
+            delete_button = self.create_button('Delete', callback=self.remove_from_queue_callback_query,
+                                               data={'message_id': message.message_id})
+            keywords['reply_markup'] = InlineKeyboardMarkup([[self.convert_button(delete_button)]] + reaction_buttons)
             keywords['disable_notification'] = True
         else:
+            # A new outer list, so extending the keyboard of one message can not change the cached rows
+            keywords['reply_markup'] = InlineKeyboardMarkup(list(reaction_buttons))
             keywords['isgroup'] = True
 
-        reaction_dict = dict((reaction, []) for reaction in message.reactions or channel_settings.reactions)
-        buttons.extend(self.get_reactions_tg_buttons(reactions=reaction_dict, with_callback=not is_preview))
-
-        keywords['reply_markup'] = self.convert_buttons(buttons)
-
         return method, keywords, reaction_dict
 
     def get_reactions_tg_buttons(self, reactions: Dict, with_callback=False):
@@ -326,9 +402,9 @@ class ChannelManager(BaseCommand):
             [
                 InlineKeyboardButton(text=f'{reaction} {len(reactions[reaction]) if reactions[reaction] else ""}',
                                      callback_data=f'reaction_button:{reaction}' if with_callback else 'nothing')
-                for reaction in list(reactions)[index:index + 4]
+                for reaction in row
             ]
-            for index in range(0, len(reactions), 4)
+            for row in self.chunks(reactions, 4)
         ]
 
     def get_all_file_ids_of_channel(self, channel_settings: ChannelSettings, force_reload: bool = False) -> Iterable[
@@ -338,30 +414,20 @@ class ChannelManager(BaseCommand):
         yield from self.get_added_file_ids_of_channel(channel_settings)
 
     def get_sent_file_id_of_chat(self, chat: TgChat, force_reload: bool = False) -> Iterable[int]:
-        for channel in ChannelSettings.objects(chat=chat):
-            if channel in self.sent_file_id_cache and not force_reload:
-                yield from self.sent_file_id_cache[channel]
-                continue
-
-            for message in channel.sent_messages:
-                message = resolve_dbref(TgMessage, message)
-                if message is None:
-                    continue
-                yield from message.file_ids
+        for channel in ChannelSettings.objects(chat=chat).only('sent_messages').no_dereference():
+            file_ids = self.sent_file_id_cache.get(channel.pk)
+            if file_ids is None or force_reload:
+                file_ids = list(chain.from_iterable(
+                    message.file_ids for message in resolve_dbrefs(TgMessage, channel.sent_messages)))
+                self.sent_file_id_cache[channel.pk] = file_ids
+            yield from file_ids
 
     def get_queued_file_ids_of_channel(self, channel_settings: ChannelSettings) -> Iterable[int]:
-        for queue in channel_settings.queued_messages.values():
-            for message in queue:
-                message = resolve_dbref(TgMessage, message)
-                if message is None:
-                    continue
-                yield from message.file_ids
+        for message in resolve_dbrefs(TgMessage, chain.from_iterable(channel_settings.queued_messages.values())):
+            yield from message.file_ids
 
     def get_added_file_ids_of_channel(self, channel_settings: ChannelSettings) -> Iterable[int]:
-        for message in channel_settings.added_messages:
-            message = resolve_dbref(TgMessage, message)
-            if message is None:
-                continue
+        for message in resolve_dbrefs(TgMessage, channel_settings.added_messages):
             yield from message.file_ids
 
     def get_similar_in_channel(self, min_similarity: float or int = None, message: TgMessage = None,
@@ -417,14 +483,14 @@ class ChannelManager(BaseCommand):
         channel.save()
 
         sent_message = None
-        for message in messages:
+        channel.reload('caption', 'reactions')
+        for index, message in enumerate(messages):
             method, include_kwargs, reaction_dict = self.prepare_send_message(message, is_preview=False, bot=bot,
-                                                                              channel_settings=channel)
+                                                                              channel_settings=channel,
+                                                                              reload_settings=False)
 
             try:
-                new_message = method(chat_id=channel.chat.id, **include_kwargs).result()
-                if not isinstance(new_message, Message):
-                    new_message = new_message.result()
+                new_message = send_and_wait(method, chat_id=channel.chat.id, **include_kwargs)
                 new_tg_message = TgMessage(new_message, reactions=reaction_dict)
                 new_tg_message.save()
 
@@ -432,14 +498,20 @@ class ChannelManager(BaseCommand):
                     if time in channel.scheduled_messages:
                         del channel.scheduled_messages[time]
 
-                    if channel in self.sent_file_id_cache:
-                        self.sent_file_id_cache[channel].extend(new_tg_message.file_ids)
-                    else:
-                        self.sent_file_id_cache[channel] = list(new_tg_message.file_ids)
+                    cached_file_ids = self.sent_file_id_cache.get(channel.pk)
+                    if cached_file_ids is not None:
+                        cached_file_ids.extend(new_tg_message.file_ids)
 
                     channel.sent_messages.append(new_tg_message)
                 if not sent_message:
                     sent_message = new_message
+            except RetryAfter as error:
+                # This runs on the job queue thread, so do not wait here. Put the messages not yet sent back into
+                # the schedule and let the job queue send them when Telegram allows it again.
+                channel.scheduled_messages[time_str] = messages[index:]
+                channel.save()
+                job_queue.run_once(self.send_scheduled_message, when=error.retry_after, context=job.context)
+                return
             except TimedOut:
                 pass
             except (Exception, BaseException):
@@ -466,11 +538,13 @@ class ChannelManager(BaseCommand):
             if sent_message.link:
                 batch_message += f' > [message]({sent_message.link})'
 
-        left = len(ChannelSettings.objects(id=channel.id).first().scheduled_messages)
+        # Batches might have been scheduled in the meantime, so only reload the schedule and not the whole channel
+        scheduled_messages = ChannelSettings.objects(id=channel.id).scalar('scheduled_messages').first() or {}
+        left = len(scheduled_messages)
         if not left:
             text = emoji.emojize(f':warning: No batches left for {channel_link}\n' + batch_message)
         else:
-            next_batch = datetime.fromtimestamp(self.first_in_schedule(channel))
+            next_batch = datetime.fromtimestamp(int(min(scheduled_messages.keys())))
             text = batch_message + f'\nThere are `{left}` scheduled batches left. Next batch is at `{next_batch}`'
 
         bot.send_message(chat_id=channel.user.id,
@@ -501,30 +575,20 @@ class ChannelManager(BaseCommand):
     def add_channel_command(self, **kwargs):
         """Add a channel to your channels
         """
-        add_to_channel_instruction = (
-            "*Adding a channel*"
-            "\n"
-            "\nTo add a channel follow these instructions"
-            "\n"
-            "\n1. Make sure @XenianChannelBot is and admin of your channel"
-            "\n2. Forward me any message from that channel"
-        )
-        self.message.reply_text(text=add_to_channel_instruction, parse_mode=ParseMode.MARKDOWN)
+        self.message.reply_text(text=ADD_CHANNEL_INSTRUCTIONS, parse_mode=ParseMode.MARKDOWN)
         self.tg_state.state = self.tg_state.ADDING_CHANNEL
 
-    @run_async
     def echo_state_command(self):
         """Debug method to send the users his state
         """
         self.message.reply_text(f'{self.tg_state.state}')
 
-    @run_async
     def reset_state_command(self):
         """Debug method to send the users his state
         """
         split_text = self.message.text.split(' ', 1)
 
-        is_admin = f'@{self.user.username}' in ADMINS
+        is_admin = f'@{self.user.username}' in ADMIN_USERNAMES
         if len(split_text) > 1 and is_admin:
             username = split_text[1].strip('@')
             user = TgUser.objects(username=username).first()
@@ -532,12 +596,10 @@ class ChannelManager(BaseCommand):
                 self.message.reply_text(f'User @{username} could not be found')
                 return
 
-        if self.tg_state.state == self.tg_state.SEND_LOCKED and f'@{self.user.username}' not in ADMINS:
+        if self.tg_state.state == self.tg_state.SEND_LOCKED and not is_admin:
             return
 
-        for message in TgMessage.objects(chat=self.tg_chat, is_current_message=True):
-            message.is_current_message = False
-            message.save()
+        TgMessage.objects(chat=self.tg_chat, is_current_message=True).update(set__is_current_message=False)
 
         self.tg_state.state = self.tg_state.IDLE
         self.list_channels_menu()
@@ -557,45 +619,42 @@ class ChannelManager(BaseCommand):
             self.add_channel_post_message_handler()
             return
 
-        if self.tg_state.state == self.tg_state.ADDING_CHANNEL:
-            self.register_channel_message_handler()
-        elif self.tg_state.state == self.tg_state.CHANGE_DEFAULT_CAPTION:
-            self.change_caption_message_handler()
-        elif self.tg_state.state == self.tg_state.CHANGE_DEFAULT_REACTION:
-            self.change_reactions_message_handler()
-        elif self.tg_state.state == self.tg_state.CREATE_SINGLE_POST:
-            self.queue_message_message_handler()
-        elif self.tg_state.state == self.tg_state.IMPORT_MESSAGES:
-            self.add_message_to_import_queue_message_handler()
-        elif self.tg_state.state == self.tg_state.SCHEDULE_ADDED_MESSAGES_WHEN and self.message.text:
-            self.schedule_delay_menu(time_str=self.message.text)
-        elif self.tg_state.state == self.tg_state.SCHEDULE_ADDED_MESSAGES_DELAY and self.message.text:
-            self.schedule_batch_size_menu(delay_str=self.message.text)
-        elif self.tg_state.state == self.tg_state.SCHEDULE_ADDED_MESSAGES_BATCH and self.message.text:
-            self.schedule_confirmation_menu(amount=self.message.text)
+        state = self.tg_state.state
+        handler = self.message_handlers.get(state)
+        if handler:
+            handler()
+            return
+
+        text_handler = self.text_message_handlers.get(state)
+        if text_handler and self.message.text:
+            method, argument_name = text_handler
+            method(**{argument_name: self.message.text})
 
     def add_channel_post_message_handler(self):
-        channel = ChannelSettings.objects(chat=self.tg_message.chat).first()
+        channel = ChannelSettings.objects(chat=self.tg_message.chat).only('chat').first()
+        if not channel:
+            return
 
-        self.tg_message.save()
-        channel.sent_messages.append(self.tg_message)
-        channel.save()
+        # The message was already saved in on_call. Push it instead of saving the whole list of sent messages and add
+        # it to elastic search directly instead of finding the new messages in before_save.
+        channel.update(push__sent_messages=self.tg_message)
+        channel.add_messages_to_elasitcsearch(self.tg_message)
+
+        cached_file_ids = self.sent_file_id_cache.get(channel.pk)
+        if cached_file_ids is not None:
+            cached_file_ids.extend(self.tg_message.file_ids)
 
     @run_async
     def register_channel_message_handler(self):
         """Add a channel to your channels
         """
         channel_chat = self.message.forward_from_chat
-        tg_channel_chat = next(iter(TgChat.objects(id=channel_chat.id)), TgChat(channel_chat))
-
-        query = {
-            'user': self.tg_user,
-            'chat': tg_channel_chat
-        }
         if not channel_chat:
             self.message.reply_text('You have to send me a message from the channel.')
             return
-        elif ChannelSettings.objects(**query):
+
+        # Check for duplicates before asking Telegram for the permissions, the chat is referenced by its id
+        if ChannelSettings.objects(user=self.tg_user, chat=channel_chat.id).limit(1).count(with_limit_and_skip=True):
             self.message.reply_text('You have already added this channel.')
             return
 
@@ -605,15 +664,18 @@ class ChannelManager(BaseCommand):
             self.message.reply_text('I need to be an administrator in the channel.')
             return
 
-        self.tg_current_channel = ChannelSettings(user=self.tg_user, chat=tg_channel_chat)
-        self.tg_current_channel.save()
-        self.tg_current_channel.cascade_save()
-
-        tg_channel_chat.user = self.tg_user
+        # TgChat already loads the existing chat from the database if there is one
+        tg_channel_chat = TgChat(channel_chat)
         tg_channel_chat.save()
+        try:
+            # The unique index on user and chat prevents duplicates, also when the same channel is sent twice at once
+            ChannelSettings(user=self.tg_user, chat=tg_channel_chat).save()
+        except NotUniqueError:
+            self.message.reply_text('You have already added this channel.')
+            return
 
         self.message.reply_text('Channel was added.')
-        self.tg_state.state = self.tg_state.IDLE
+        # Resets the current channel and the state
         self.list_channels_menu()
 
     def queue_message_message_handler(self, *args, **kwargs):
@@ -623,12 +685,11 @@ class ChannelManager(BaseCommand):
             self.message.reply_text('This type of message is not supported.', reply_message_id=self.message.message_id)
             return
 
-        file_ids = list(self.get_all_file_ids_of_channel(self.tg_current_channel))
-        already_queued = False
-        if [id for id in self.tg_message.file_ids if id in file_ids]:
-            already_queued = True
+        file_ids = set(self.get_all_file_ids_of_channel(self.tg_current_channel))
+        already_queued = any(id in file_ids for id in self.tg_message.file_ids)
 
-        similar_images = self.get_similar_in_channel()
+        # Only run the image search (file download + elastic search query) if the file itself is not yet known
+        similar_images = self.get_similar_in_channel() if not already_queued else []
         if not already_queued and [entry for entry in similar_images if entry['dist'] <= 0.8]:
             already_queued = True
 
@@ -644,13 +705,9 @@ class ChannelManager(BaseCommand):
             elif [entry for entry in similar_images if entry['dist'] <= 0.3]:
                 text = already_sent_temp.format(prefix=emoji.emojize(':warning:'), percentage='70')
             if text:
-                additional_buttons.append([self.convert_button(self.create_button(text=text, prefix='nothing'))])
-
-            self.tg_message.save()
-            collection = self.tg_current_channel._get_collection()
-            collection.update({'_id': self.tg_current_channel.id},
-                              {'$push': {'added_messages': self.tg_message.id}})
+                additional_buttons.append([InlineKeyboardButton(text=text, callback_data='nothing')])
 
+            self.tg_current_channel.update(push__added_messages=self.tg_message)
 
             method, include_kwargs, reaction_dict = self.prepare_send_message(self.tg_message, is_preview=True)
             if additional_buttons:
@@ -671,13 +728,15 @@ class ChannelManager(BaseCommand):
             self.message.reply_text('This type of message is not supported.', reply_message_id=self.message.message_id)
             return
 
-        if self.tg_message in self.tg_current_channel.sent_messages:
+        is_sent = ChannelSettings.objects(pk=self.tg_current_channel.pk, sent_messages=self.tg_message) \
+            .limit(1).count(with_limit_and_skip=True)
+        if is_sent:
             self.message.reply_text('I know this message already', disable_notification=True,
                                     reply_message_id=self.message.message_id)
         else:
-            self.tg_message.save()
+            # The message itself was already saved in on_call, only push it instead of saving the whole list
+            self.tg_current_channel.update(push__import_messages=self.tg_message)
             self.tg_current_channel.import_messages.append(self.tg_message)
-            self.tg_current_channel.save()
 
         job = job_queue.run_once(
             lambda bot_, _job, **__: self.import_messages_menu(recreate_message=True),
@@ -697,10 +756,10 @@ class ChannelManager(BaseCommand):
 
     @run_async
     def change_reactions_message_handler(self):
-        emojis = emoji.emoji_lis(self.message.text)
-        reactions = [reaction['emoji'] for reaction in emojis]
+        # The regex is compiled once by emoji itself and also matches emojis made of multiple characters
+        reactions = emoji.get_emoji_regexp().findall(self.message.text or '')
 
-        if not self.message.text or not emojis:
+        if not reactions:
             self.message.reply_text('You have to send me some some reactions (Emoji).')
             return
 
@@ -721,18 +780,25 @@ class ChannelManager(BaseCommand):
         self.tg_current_channel = None
         self.tg_state.state = self.tg_state.IDLE
 
-        channels = ChannelSettings.objects(user=self.tg_user)
+        # Join the chats on the database side instead of loading each channel and its chat one by one
+        channels = list(ChannelSettings.objects(user=self.tg_user).aggregate(
+            {'$project': {'chat': 1}},
+            {'$lookup': {'from': TgChat._get_collection_name(), 'localField': 'chat', 'foreignField': '_id',
+                         'as': 'chat'}},
+            {'$unwind': '$chat'},
+        ))
         if not channels:
             self.message.reply_text('You do not have any channels configured use /addchannel to add one.')
             return
 
         buttons = [
             [
-                self.create_button(text=f'@{channel.chat.username}' if channel.chat.username else channel.chat.title,
-                                   data={'channel_settings_id': channel.id}, callback=self.channel_actions_menu)
-                for channel in channels[index:index + 2]
+                self.create_button(text=f'@{channel["chat"]["username"]}' if channel['chat'].get('username')
+                                   else channel['chat'].get('title'),
+                                   data={'channel_settings_id': channel['_id']}, callback=self.channel_actions_menu)
+                for channel in row
             ]
-            for index in range(0, len(channels), 2)
+            for row in self.chunks(channels, 2)
         ]
 
         buttons.append([self.create_button(text='Add new channel', callback=self.add_channel_command)])
@@ -823,7 +889,7 @@ class ChannelManager(BaseCommand):
             text=f'Channel: {chat_name}\nForward me messages from your channel or upload images to import them as '
             f'"sent messages". \nLike this I can check if a message has already been sent when you create a post.\n\n'
             f'When all messages has been sent, hit the "Finish" button. The back button will cancel the import.\n\n'
-            f'Currently in the queue: `{len(self.tg_current_channel.import_messages)}`',
+            f'Currently in the queue: `{self.tg_current_channel.count_messages("import_messages")}`',
             reply_markup=self.convert_buttons(buttons), parse_mode=ParseMode.MARKDOWN, create=recreate_message)
 
     @run_async
@@ -849,8 +915,7 @@ class ChannelManager(BaseCommand):
         ]
 
         chat_name = self.get_username_or_link(self.tg_current_channel, is_markdown=True)
-        self.tg_current_channel.reload('added_messages')
-        added_amount = len(self.tg_current_channel.added_messages)
+        added_amount = self.tg_current_channel.count_messages('added_messages')
         self.create_or_update_button_message(
             text=f'Channel: {chat_name}\nSend me messages to be sent to the channel\n'
             f'Currently `{added_amount}` are added.',
@@ -922,10 +987,11 @@ class ChannelManager(BaseCommand):
             occasions = list(channel.scheduled_messages.keys())[-2:]
             return datetime.fromtimestamp(int(occasions[1])) - datetime.fromtimestamp(int(occasions[0]))
         elif len(channel.sent_messages) > 1:
-            occasions = channel.sent_messages[-2:]
-            if not occasions[0].object or not occasions[1].object:
+            # Read the stored timestamps instead of building whole telegram messages from the stored dicts
+            dates = [(message.original_object or {}).get('date') for message in channel.sent_messages[-2:]]
+            if not dates[0] or not dates[1]:
                 return None
-            return occasions[1].object.date - occasions[0].object.date
+            return timedelta(seconds=dates[1] - dates[0])
         return None
 
     @run_async
@@ -1063,7 +1129,7 @@ class ChannelManager(BaseCommand):
         amount = (button.data.get('amount') if button is not None else amount) or amount
 
         try:
-            amount = re.sub('\D', '', amount)
+            amount = NON_DIGIT_RE.sub('', amount)
             int(amount)
         except ValueError:
             self.message.reply_text('The given text could not be evaluated as a number.')
@@ -1141,10 +1207,10 @@ class ChannelManager(BaseCommand):
         ]]
         buttons.extend([
             [
-                self.create_button(text=reaction, prefix='nothing')
-                for reaction in reactions[index:index + 4]
+                InlineKeyboardButton(text=reaction, callback_data='nothing')
+                for reaction in row
             ]
-            for index in range(0, len(reactions), 4)
+            for row in self.chunks(reactions, 4)
         ])
 
         self.create_or_update_button_message(
@@ -1247,10 +1313,11 @@ class ChannelManager(BaseCommand):
             self.create_post_menu(recreate_message=True)
 
     def chunks(self, lischt, n):
-        if not hasattr(lischt, '__len__'):
-            lischt = list(lischt)
-        for i in range(0, len(lischt), n):
-            yield lischt[i:i + n]
+        iterator = iter(lischt)
+        chunk = list(islice(iterator, n))
+        while chunk:
+            yield chunk
+            chunk = list(islice(iterator, n))
 
     # Post section
     @run_async
@@ -1261,8 +1328,7 @@ class ChannelManager(BaseCommand):
 
         # Move items to queue
         self.tg_state.state = self.tg_state.SEND_LOCKED
-        messages = list(filter(None, map(
-            lambda msg: resolve_dbref(TgMessage, msg), self.tg_current_channel.added_messages)))
+        messages = resolve_dbrefs(TgMessage, self.tg_current_channel.added_messages)
 
         uuid = None
         self.tg_current_channel.queued_messages = self.tg_current_channel.queued_messages or {}
@@ -1288,40 +1354,88 @@ class ChannelManager(BaseCommand):
         if not preview:
             self.create_post_menu(recreate_message=True)
 
-        for index, stored_message in progress_bar.enumerate(messages[:]):
+        if messages:
+            # Show the progress bar first, otherwise its message would be queued behind all the messages to send
+            progress_bar.start(items=messages)
+
+        error = None
+        pending = []
+        if not preview:
+            self.tg_current_channel.reload('caption', 'reactions')
+        for stored_message in messages:
             try:
-                method, include_kwargs, reaction_dict = self.prepare_send_message(stored_message, is_preview=preview)
-
-                new_message = method(chat_id=send_to.id, **include_kwargs).result()
-                if isinstance(new_message, Promise):
-                    new_message = new_message.result()
-                if not preview:
-                    new_tg_message = TgMessage(new_message, reactions=reaction_dict)
-                    new_tg_message.save()
-
-                    if self.tg_current_channel in self.sent_file_id_cache:
-                        self.sent_file_id_cache[self.tg_current_channel].extend(new_tg_message.file_ids)
-                    else:
-                        self.sent_file_id_cache[self.tg_current_channel] = list(new_tg_message.file_ids)
-
-                    self.tg_current_channel.queued_messages[uuid].remove(stored_message)
-                    self.tg_current_channel.sent_messages.append(new_tg_message)
-            except TimedOut:
-                pass
+                pending.append((stored_message, *self.prepare_send_message(stored_message, is_preview=preview,
+                                                                           reload_settings=False)))
             except (BaseException, Exception) as e:
-                if not preview:
-                    # Move queued messages back to added messages if an error occurs
-                    if self.tg_current_channel.added_messages is None:
-                        self.tg_current_channel.added_messages = []
-
-                    self.tg_current_channel.added_messages += self.tg_current_channel.queued_messages[uuid]
-                    del self.tg_current_channel.queued_messages[uuid]
-                    self.tg_current_channel.save()
+                error = e
+                break
+
+        sent_messages = []
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            # Queue all messages at once. The message queue sends them in order, meanwhile the sent ones are stored.
+            queued = [(entry, entry[1](chat_id=send_to.id, **entry[2])) for entry in pending]
+            pending = []
+            retry_after = 0
+            for entry, promise in queued:
+                stored_message, method, include_kwargs, reaction_dict = entry
+                try:
+                    new_message = send_and_wait(method, pending=promise)
+                except RetryAfter as e:
+                    # The messages queued after this one most likely hit the flood limit as well. Collect every
+                    # message which was not sent, so they are queued again in their order after waiting only once.
+                    retry_after = max(retry_after, e.retry_after)
+                    pending.append(entry)
+                    continue
+                except TimedOut:
+                    pass
+                except (BaseException, Exception) as e:
+                    # The following messages are already queued, so wait for them before handling the error
+                    error = error or e
+                else:
+                    if not preview:
+                        # A message which was just sent can not be in the database, so skip the lookup in
+                        # TgMessage.__new__
+                        new_tg_message = TgMessage(reactions=reaction_dict)
+                        new_tg_message.self_from_object(new_message)
+                        sent_messages.append(new_tg_message)
+
+                        self.tg_current_channel.queued_messages[uuid].remove(stored_message)
+                progress_bar.increase()
+
+            if not pending:
+                break
+            elif attempt == SEND_ATTEMPTS:
+                error = error or RetryAfter(retry_after)
+            else:
+                # Only the worker sending this post waits, the job queue and other updates keep running
+                time.sleep(retry_after)
+
+        if sent_messages:
+            # Store all sent messages with one insert and push them at once instead of saving the whole sent list
+            for message, message_id in zip(sent_messages, TgMessage.objects.insert(sent_messages, load_bulk=False)):
+                message.id = message_id
+            self.tg_current_channel.update(
+                __raw__={'$push': {'sent_messages': {'$each': [message.pk for message in sent_messages]}}})
+            self.tg_current_channel.add_messages_to_elasitcsearch(sent_messages)
+
+            cached_file_ids = self.sent_file_id_cache.get(self.tg_current_channel.pk)
+            if cached_file_ids is not None:
+                cached_file_ids.extend(chain.from_iterable(message.file_ids for message in sent_messages))
+
+        if error:
+            if not preview:
+                # Move the messages which were not sent back to added messages
+                if self.tg_current_channel.added_messages is None:
+                    self.tg_current_channel.added_messages = []
+
+                self.tg_current_channel.added_messages += self.tg_current_channel.queued_messages[uuid]
+                del self.tg_current_channel.queued_messages[uuid]
+                self.tg_current_channel.save()
 
-                self.message.reply_text('An error occurred please contact an admin with /error')
-                self.tg_state.state = self.tg_state.CREATE_SINGLE_POST
-                self.create_post_menu(recreate_message=True)
-                raise e
+            self.message.reply_text('An error occurred please contact an admin with /error')
+            self.tg_state.state = self.tg_state.CREATE_SINGLE_POST
+            self.create_post_menu(recreate_message=True)
+            raise error
 
         self.tg_current_channel.save()
         if preview:
@@ -1394,23 +1508,44 @@ class ChannelManager(BaseCommand):
 
     def reaction_button_callback_query(self):
         reaction = self.update.callback_query.data.replace('reaction_button:', '')
-        message = TgMessage.objects(message_id=self.message.message_id, chat=self.tg_chat).first()
+        # The reaction is used in the field path, the reactions of the message are known from its buttons
+        reactions = [button.callback_data.replace('reaction_button:', '')
+                     for row in self.message.reply_markup.inline_keyboard for button in row
+                     if (button.callback_data or '').startswith('reaction_button:')]
 
-        if not message or reaction not in message.reactions:
+        if '.' in reaction or reaction.startswith('$') or reaction not in reactions:
             self.update.callback_query.answer('Something went wrong.')
             return
 
-        if self.tg_user in message.reactions[reaction]:
-            self.update.callback_query.answer()
-            return
+        # Users are stored as generic references in the reactions. Remove the user from all other reactions and add
+        # it to the chosen one in a single atomic update, so simultaneous votes do not overwrite each other.
+        user_ref = GenericReferenceField().to_mongo(self.tg_user)
+        update = {'$addToSet': {f'reactions.{reaction}': user_ref}}
+        pull = {f'reactions.{other}': {'_ref': user_ref['_ref']} for other in reactions if other != reaction}
+        if pull:
+            update['$pull'] = pull
+
+        message_filter = {'message_id': self.message.message_id, 'chat': self.tg_chat.pk}
+        message = TgMessage._get_collection().find_one_and_update(
+            {
+                **message_filter,
+                f'reactions.{reaction}': {'$exists': True},
+                f'reactions.{reaction}._ref': {'$ne': user_ref['_ref']},
+            },
+            update,
+            projection={'reactions': True},
+            return_document=ReturnDocument.AFTER,
+        )
 
-        for available_reaction, users in message.reactions.items():
-            if self.tg_user in users:
-                message.reactions[available_reaction].remove(self.tg_user)
-        message.reactions[reaction].append(self.tg_user)
-        message.save()
+        if not message:
+            # Either the user already voted for this reaction or the message does not exist
+            if TgMessage.objects(**message_filter).limit(1).count(with_limit_and_skip=True):
+                self.update.callback_query.answer()
+            else:
+                self.update.callback_query.answer('Something went wrong.')
+            return
 
-        buttons = InlineKeyboardMarkup(self.get_reactions_tg_buttons(message.reactions, with_callback=True))
+        buttons = InlineKeyboardMarkup(self.get_reactions_tg_buttons(message['reactions'], with_callback=True))
         self.message.edit_reply_markup(reply_markup=buttons)
         self.update.callback_query.answer(emoji.emojize('Thanks for voting :thumbs_up:'))
 
@@ -0,0 +1,68 @@
+import logging
+from collections import defaultdict
+
+from pymongo import MongoClient
+
+from xenian_channel.bot import MONGODB_CONFIGURATION
+
+mongodb_client = MongoClient(host=MONGODB_CONFIGURATION['host'], port=MONGODB_CONFIGURATION['port'],
+                             username=MONGODB_CONFIGURATION['username'], password=MONGODB_CONFIGURATION['password'],
+                             authSource='admin')
+mongodb_database = mongodb_client[MONGODB_CONFIGURATION['db_name']]
+
+logger = logging.getLogger('Mongo Duplicate Channel Settings Migration')
+
+
+class Migrator:
+    """Merge channel settings with the same user and chat into one
+
+    Adding the same channel twice at once could create two settings for the same user and chat. They have to be merged
+    before the unique index on user and chat of :class:`xenian_channel.bot.models.ChannelSettings` can be created, so
+    run this migration before starting the bot.
+    """
+    list_fields = ['sent_messages', 'added_messages', 'import_messages']
+    dict_fields = ['queued_messages', 'import_messages_queue', 'scheduled_messages']
+
+    channel_col = mongodb_database.channel_settings
+    user_state_col = mongodb_database.user_state
+
+    def __call__(self, *args, **kwargs):
+        self.migrate()
+
+    def migrate(self):
+        groups = defaultdict(list)
+        for channel in self.channel_col.find().sort('_id'):
+            groups[(channel.get('user'), channel.get('chat'))].append(channel)
+
+        for (user, chat), channels in groups.items():
+            if len(channels) < 2:
+                continue
+
+            logger.info(f'Merging {len(channels)} channel settings of user {user} in chat {chat}')
+            kept, duplicates = channels[0], channels[1:]
+            self.merge(kept, duplicates)
+
+            duplicate_ids = [duplicate['_id'] for duplicate in duplicates]
+            self.channel_col.replace_one({'_id': kept['_id']}, kept)
+            self.user_state_col.update_many({'current_channel': {'$in': duplicate_ids}},
+                                            {'$set': {'current_channel': kept['_id']}})
+            self.channel_col.delete_many({'_id': {'$in': duplicate_ids}})
+
+    def merge(self, kept: dict, duplicates: list):
+        """Add everything from the duplicates to the kept settings, the order of the kept settings comes first
+        """
+        for duplicate in duplicates:
+            for field in self.list_fields:
+                items = kept.get(field) or []
+                items.extend(item for item in duplicate.get(field) or [] if item not in items)
+                kept[field] = items
+
+            for field in self.dict_fields:
+                items = kept.get(field) or {}
+                for key, messages in (duplicate.get(field) or {}).items():
+                    items.setdefault(key, []).extend(message for message in messages if message not in items[key])
+                kept[field] = items
+
+            for field in ['caption', 'reactions']:
+                if not kept.get(field) and duplicate.get(field):
+                    kept[field] = duplicate[field]
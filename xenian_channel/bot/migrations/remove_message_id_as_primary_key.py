@@ -1,5 +1,4 @@
 import logging
-from copy import deepcopy
 
 from bson import ObjectId
 from pymongo import MongoClient
@@ -36,7 +35,7 @@ class Message:
             self.new_message = message
 
     def get_new_message(self):
-        message = deepcopy(self.old_message)
+        message = dict(self.old_message)
         message['_id'] = self.new_id
         message['message_id'] = self.old_id
         return message
@@ -16,6 +16,8 @@ __all__ = ['ChannelSettings']
 
 
 class ChannelSettings(Document):
+    meta = {'indexes': [{'fields': ('user', 'chat'), 'unique': True}, 'chat']}
+
     _logger = logging.getLogger('ChannelSettings')
     chat = ReferenceField(TgChat)
     user = ReferenceField(TgUser)
@@ -50,6 +52,21 @@ class ChannelSettings(Document):
         finally:
             self.save_lock.release()
 
+    def count_messages(self, field: str) -> int:
+        """Count the messages in a list field on the database side
+
+        Accessing the list itself would load all the messages it references.
+
+        Args:
+            field (:obj:`str`): Name of the list field, like `added_messages`
+
+        Returns:
+            :obj:`int`: Amount of messages in the field
+        """
+        result = next(ChannelSettings.objects(pk=self.pk).aggregate(
+            {'$project': {'amount': {'$size': {'$ifNull': [f'${field}', []]}}}}), None)
+        return result['amount'] if result else 0
+
     def add_messages_to_elasitcsearch(self, messages: Iterable[TgMessage] or TgMessage or Bot, job: Job = None):
         if isinstance(job, Job) and isinstance(messages, Bot):
             messages = job.context
@@ -15,10 +15,7 @@ class OptionStringField(StringField):
         if not all(map(lambda item: isinstance(item, str), options)):
             raise ValueError('Options are not valid. It must be a Iterable of str\'s.')
 
-        regex = '^('
-        for string in options:
-            regex += f'{string}|'
-        regex = regex.rstrip('|') + ')$'
+        regex = '^({})$'.format('|'.join(options))
 
         super().__init__(regex, **kwargs)
 
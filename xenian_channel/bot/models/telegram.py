@@ -11,6 +11,7 @@ __all__ = ['TelegramDocument']
 class TelegramDocument(Document):
     _tg_object = None
     _bot = None
+    _fields_cache = {}
     meta = {'abstract': True}
 
     save_lock = Lock()
@@ -22,17 +23,13 @@ class TelegramDocument(Document):
     def __new__(cls, *args, **kwargs):
         first_arg = next(iter(args), None)
         if first_arg is not None and isinstance(first_arg, TelegramObject):
-            pk_name = 'id'
-            for key, value in cls.fields().items():
-                if key != 'id' and value.primary_key:
-                    pk_name = key
-                    break
+            pk_name = cls._meta.get('id_field') or 'id'
             pk = getattr(first_arg, pk_name, None)
 
             if pk is not None:
                 obj = cls.objects(**{pk_name: pk}).first()
                 if obj:
-                    obj.self_from_object(first_arg)
+                    # __init__ is called right after with the same telegram object, which fills in the fields
                     return obj
         return super().__new__(cls)
 
@@ -64,7 +61,10 @@ class TelegramDocument(Document):
 
     @classmethod
     def fields(cls):
-        return dict(filter(lambda item: isinstance(item[1], BaseField), cls.__dict__.items()))
+        if cls not in TelegramDocument._fields_cache:
+            TelegramDocument._fields_cache[cls] = dict(
+                filter(lambda item: isinstance(item[1], BaseField), cls.__dict__.items()))
+        return TelegramDocument._fields_cache[cls]
 
     def _load_self(self, bot: Bot = None, force_update=False):
         """Load original telegram object
@@ -14,7 +14,10 @@ __all__ = ['TgMessage']
 
 
 class TgMessage(TelegramDocument):
-    meta = {'collection': 'telegram_message'}
+    meta = {
+        'collection': 'telegram_message',
+        'indexes': [('chat', 'message_id'), ('chat', 'is_current_message')],
+    }
     file_types = [
         'audio',
         'sticker',
@@ -44,10 +47,9 @@ class TgMessage(TelegramDocument):
     def __new__(cls, *args, **kwargs):
         first_arg = next(iter(args), None)
         if first_arg is not None and isinstance(first_arg, Message):
-            chat = TgChat.objects(id=first_arg.chat.id).first()
-            obj = cls.objects(message_id=first_arg.message_id, chat=chat).first()
+            # The chat is referenced by its id, so there is no need to load it first
+            obj = cls.objects(message_id=first_arg.message_id, chat=first_arg.chat.id).first()
             if obj:
-                obj.self_from_object(first_arg)
                 return obj
         return super().__new__(cls)
 
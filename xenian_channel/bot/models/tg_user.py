@@ -7,7 +7,7 @@ __all__ = ['TgUser']
 
 
 class TgUser(TelegramDocument):
-    meta = {'collection': 'telegram_user'}
+    meta = {'collection': 'telegram_user', 'indexes': ['username']}
 
     class Meta:
         original = User
@@ -11,6 +11,8 @@ APPEND_SCHEDULE = 'append schedule'
 EXTEND_SCHEDULE = 'extend schedule'
 
 class UserState(Document):
+    meta = {'indexes': ['user']}
+
     IDLE = 'idle'
     ADDING_CHANNEL = 'adding channel'
     REMOVING_CHANNEL = 'removing channel'
@@ -37,8 +39,10 @@ class UserState(Document):
     save_lock = Lock()
 
     def __setattr__(self, key, value):
+        # Only save if the state actually changed, the menus often set the state the user is already in
+        save = key == 'state' and self._initialised and value != self.state
         super(UserState, self).__setattr__(key, value)
-        if self._initialised and key == 'state':
+        if save:
             self.save()
 
     def __repr__(self):
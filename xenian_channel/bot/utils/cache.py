@@ -1,6 +1,8 @@
 import time
+from collections import OrderedDict
+from threading import Lock
 
-__all__ = ['MWT']
+__all__ = ['MWT', 'LRUCache']
 
 
 class MWT(object):
@@ -32,14 +34,41 @@ class MWT(object):
             key = (args, tuple(kw))
             try:
                 v = self.cache[key]
-                print("cache")
                 if (time.time() - v[1]) > self.timeout:
                     raise KeyError
             except KeyError:
-                print("new")
                 v = self.cache[key] = f(*args, **kwargs), time.time()
             return v[0]
 
         func.func_name = f.__name__
 
         return func
+
+
+class LRUCache(OrderedDict):
+    """Dict with a maximum size which drops the least recently used items
+
+    Only :meth:`get` and setting items count as usage and are thread safe.
+
+    Args:
+        maxsize (:obj:`int`, optional): Maximum number of items, defaults to 128
+    """
+
+    def __init__(self, maxsize: int = 128):
+        super().__init__()
+        self.maxsize = maxsize
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self:
+                return default
+            self.move_to_end(key)
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            if len(self) > self.maxsize:
+                self.popitem(last=False)
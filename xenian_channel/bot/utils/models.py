@@ -1,4 +1,4 @@
-from typing import Type
+from typing import Iterable, List, Type
 
 from bson import DBRef
 from mongoengine import Document
@@ -11,3 +11,41 @@ def resolve_dbref(document: Type[Document], dbref: dict or DBRef or Document) ->
         return dbref
 
     return document.objects(pk=dbref.id).first()
+
+
+def resolve_dbrefs(document: Type[Document], dbrefs: Iterable[dict or DBRef or Document]) -> List[Document]:
+    """Resolve multiple references with a single query
+
+    Already loaded documents are taken as they are, all others are fetched at once with a `$in` query instead of one
+    query per reference. References which could not be resolved are skipped, the order is kept.
+
+    Args:
+        document (:obj:`Type[Document]`): Document class the references point to
+        dbrefs (:obj:`Iterable`): References as `DBRef`, dict containing `_ref` or already loaded documents
+
+    Returns:
+        :obj:`List[Document]`: The resolved documents
+    """
+    items = []
+    missing_ids = []
+    for dbref in dbrefs:
+        if isinstance(dbref, dict) and '_ref' in dbref:
+            dbref = dbref['_ref']
+
+        if isinstance(dbref, document):
+            items.append(dbref)
+        elif isinstance(dbref, DBRef):
+            items.append(dbref.id)
+            missing_ids.append(dbref.id)
+
+    if not missing_ids:
+        return items
+
+    loaded = {obj.pk: obj for obj in document.objects(pk__in=missing_ids)}
+    resolved = []
+    for item in items:
+        if isinstance(item, document):
+            resolved.append(item)
+        elif item in loaded:
+            resolved.append(loaded[item])
+    return resolved
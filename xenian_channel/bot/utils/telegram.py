@@ -2,25 +2,11 @@ from functools import wraps
 from inspect import getfullargspec
 from typing import Callable, Dict
 
-from telegram import Bot, Chat, Update, User
+from telegram import Chat, Message, Update, User
 from telegram.error import NetworkError, TimedOut
+from telegram.utils.promise import Promise
 
-from . import MWT
-
-__all__ = ['get_self', 'get_user_chat_link']
-
-
-@MWT(timeout=60 * 60)
-def get_self(bot: Bot) -> User:
-    """Get User object of this bot
-
-    Args:
-        bot (:obj:`Bot`): Telegram Api Bot Object
-
-    Returns:
-        :obj:`User`: The user object of this bot
-    """
-    return bot.get_me()
+__all__ = ['get_user_chat_link', 'send_and_wait']
 
 
 def get_user_chat_link(user: User or Chat or Dict, as_link: bool = False) -> str or None:
@@ -41,6 +27,33 @@ def get_user_chat_link(user: User or Chat or Dict, as_link: bool = False) -> str
         return '[{}](tg://user?id={})'.format(user.first_name, user.id)
 
 
+def send_and_wait(method: Callable, *args, pending: Promise = None, **kwargs) -> Message:
+    """Send a message and wait until it was sent
+
+    Sending is rate limited by the bots message queue. If Telegram still asks us to slow down the
+    :class:`telegram.error.RetryAfter` is raised. This function never waits for it itself, because it is also used
+    from the job queue thread. The caller decides how to send the message again.
+
+    Args:
+        method (:obj:`Callable`): A send method of the bot like :meth:`telegram.bot.Bot.send_message`
+        *args: Arguments for the send method
+        pending (:obj:`Promise`, optional): The message was already queued, wait for this promise instead of sending
+            it again.
+        **kwargs: Keyword arguments for the send method
+
+    Raises:
+        (:class:`telegram.error.RetryAfter`): If Telegram asks us to wait before sending more messages
+
+    Returns:
+        :obj:`telegram.message.Message`: The sent message
+    """
+    result = pending if pending is not None else method(*args, **kwargs)
+    # Queued messages return a promise, which can be nested if it was queued from within the queue
+    while isinstance(result, Promise):
+        result = result.result()
+    return result
+
+
 def retry_command(retries: int = None, *args, notify_user=True, existing_update: Update = None,
                   **kwargs) -> Callable:
     """Decorater to retry a command if it raises :class:`telegram.error.TimedOut`
@@ -63,30 +76,33 @@ def retry_command(retries: int = None, *args, notify_user=True, existing_update:
         retries = 3
     retries = retries or 3
 
-    def wrapper(*args, **kwargs):
-        error = None
-        for try_ in range(retries):
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
             error = None
-            print(f'Try {try_}')
-            try:
-                return func(*args, **kwargs)
-            except (TimedOut, NetworkError) as e:
-                if isinstance(e, TimedOut) or (
-                        isinstance(e, NetworkError) and 'The write operation timed out' in e.message):
-                    error = e
-        else:
-            if notify_user and existing_update or (len(args) > 1 and getattr(args[1], 'message', None)):
-                update = existing_update or args[1]
-                update.message.reply_text(text='Command failed at some point after multiple retries. '
-                                               'Try again later or contact an admin /support.',
-                                          reply_to_message_id=update.message.message_id)
-            if error:
-                raise error
+            for _ in range(retries):
+                error = None
+                try:
+                    return func(*args, **kwargs)
+                except (TimedOut, NetworkError) as e:
+                    if isinstance(e, TimedOut) or (
+                            isinstance(e, NetworkError) and 'The write operation timed out' in e.message):
+                        error = e
+            else:
+                if notify_user and existing_update or (len(args) > 1 and getattr(args[1], 'message', None)):
+                    update = existing_update or args[1]
+                    update.message.reply_text(text='Command failed at some point after multiple retries. '
+                                                   'Try again later or contact an admin /support.',
+                                              reply_to_message_id=update.message.message_id)
+                if error:
+                    raise error
 
-    if func:
         return wrapper
 
-    return wraps(wrapper)
+    if func:
+        return decorator(func)
+
+    return decorator
 
 
 def keep_message_args(func):
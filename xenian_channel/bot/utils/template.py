@@ -1,19 +1,20 @@
-import os
 import re
 
 from htmlmin import minify
-from mako.template import Template
+from mako.lookup import TemplateLookup
 
-from ..settings import TEMPLATE_DIR
+from ..settings import DEBUG, TEMPLATE_DIR
 
 __all__ = ['render_template']
 
+LINE_BREAK_RE = re.compile('(<br\s?/?>|\\\\n)')
+
+# Compiled templates are kept by the lookup, only check for changed template files while developing
+template_lookup = TemplateLookup(directories=[TEMPLATE_DIR], filesystem_checks=DEBUG)
+
 
 def render_template(template_name: str, **kwargs):
-    template = Template(filename=os.path.join(TEMPLATE_DIR, template_name))
+    template = template_lookup.get_template(template_name)
     rendered_template = template.render(**kwargs)
-    minified = re.sub('(<br\s?/?>|\\\\n)', '\n', minify(rendered_template, remove_empty_space=True))
-    cleaned = ''
-    for part in minified.split('\n'):
-        cleaned += part.strip() + '\n'
-    return cleaned.strip()
+    minified = LINE_BREAK_RE.sub('\n', minify(rendered_template, remove_empty_space=True))
+    return '\n'.join(part.strip() for part in minified.split('\n')).strip()